@@ -6,20 +6,41 @@ SupportAgent with safe/robust Gemini integration.
   runs in fallback mode (FAQ + local behavior) and does NOT crash the app.
 - When the SDK + key are available, the agent auto-selects a model and uses
   a resilient caller to attempt different call signatures.
+- FAQ matching uses rapidfuzz's fuzz.token_set_ratio, whose bit-parallel
+  Levenshtein core ships with the package (no python-Levenshtein needed).
+- process_query_async runs the same flow but awaits the model round-trip, so
+  one event loop can serve many concurrent users.
 """
 
+import asyncio
+import contextlib
+import inspect
+import json
+import logging
 import os
-from typing import Optional, Tuple, List
-from fuzzywuzzy import fuzz
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import cached_property, lru_cache
+from typing import Any, Callable, ContextManager, Dict, Iterator, NamedTuple, Optional, Sequence, Tuple, List, Union
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
 
-# Try to import the Gemini SDK; handle gracefully if not present.
-try:
-    import google.generativeai as genai  # type: ignore
-    GEMINI_SDK_AVAILABLE = True
-except Exception as e:
-    genai = None  # type: ignore
-    GEMINI_SDK_AVAILABLE = False
-    print("[agent_logic] google.generativeai not available:", repr(e))
+from batching import BatchScheduler
+from cache import KVCache, SemanticCache
+from faq_index import FaqIndex
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# The Gemini SDK is imported and configured by _ensure_ready() on first SupportAgent
+# construction, so importing this module stays cheap
+genai = None  # type: ignore
+GEMINI_SDK_AVAILABLE = False
+_INIT_LOCK = threading.Lock()
+_INITIALIZED = False
 
 # optional dotenv (non-fatal)
 try:
@@ -32,28 +53,392 @@ except Exception:
 # Read API key from env
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Configure genai only if available and key present
-if GEMINI_SDK_AVAILABLE and GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-    except Exception as e:
-        print("[agent_logic] genai.configure failed:", repr(e))
-        GEMINI_SDK_AVAILABLE = False
+
+def _env_flag(name: str) -> bool:
+    """True when the environment variable is set to 1 / true / yes (any case)."""
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes")
+
+
+# Paraphrase-tolerant response cache; off by default since it needs
+# sentence-transformers + faiss and only suits deterministic, non-personalized answers
+SEMANTIC_CACHE_ENABLED = _env_flag("SEMANTIC_CACHE")
+
+# Match FAQs by embedding similarity as well as fuzzy string score
+SEMANTIC_FAQ_ENABLED = _env_flag("SEMANTIC_FAQ")
+
+# SQLite file that persists cached answers across restarts / workers (unset = memory only)
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB")
+
+# Coalesce concurrent async model calls into short batching windows
+LLM_BATCHING_ENABLED = _env_flag("LLM_BATCHING")
+
+# Keep the system instruction + FAQ corpus in Gemini's context cache and send only
+# the user turn per request (the API enforces a minimum cached token count)
+GEMINI_CONTEXT_CACHE_ENABLED = _env_flag("GEMINI_CONTEXT_CACHE")
+CONTEXT_CACHE_TTL = timedelta(hours=1)
+CONTEXT_CACHE_RENEW_BEFORE = timedelta(minutes=5)
+
+# Client-side budget matching the account's Gemini quota (requests / tokens per minute)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "1000"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "2000000"))
+_RATE_LIMITER = TokenBucket(GEMINI_RPM, GEMINI_TPM)
 
 # Preferred generation method names (try in order)
-PREFERRED_METHODS = [
+PREFERRED_METHODS = (
     "generate_content",
     "generateContent",
     "generate_text",
     "generateText",
     "generate",
-]
+)
 
 # Candidate model name filters (preference order)
-PREFERRED_MODEL_KEYWORDS = ["gemini", "chat-bison", "text-bison", "bison", "gpt", "llama"]
+PREFERRED_MODEL_KEYWORDS = ("gemini", "chat-bison", "text-bison", "bison", "gpt", "llama")
 
+class AgentResponse(NamedTuple):
+    """
+    Result of SupportAgent.process_query. Still a 4-tuple, so callers that unpack
+    (text, escalated, reason, actions) positionally keep working.
+    """
 
-def _select_model_and_method() -> Tuple[Optional[str], Optional[str]]:
+    reply: str
+    escalate: bool
+    reason: Optional[str]
+    suggestions: Optional[Sequence[str]]
+
+
+class StreamingAgentResponse(NamedTuple):
+    """
+    Result of SupportAgent.process_query_stream: like AgentResponse, but a model
+    answer's reply is an iterator of text chunks still being generated.
+    """
+
+    reply: Union[str, Iterator[str]]
+    escalate: bool
+    reason: Optional[str]
+    suggestions: Optional[Sequence[str]]
+
+
+# Appended to a streamed answer that broke off partway
+STREAM_INTERRUPTED_NOTICE = "\n\n_(answer interrupted — please ask again)_"
+
+
+class _ModelRequest(NamedTuple):
+    """A query that process_query could not answer locally and must send to the model."""
+
+    query: str
+    cache_key: str
+    prompt: str
+    faq_idx: Optional[int]
+    confidence: float
+
+
+# Max number of normalized queries kept in the exact-match response cache
+RESPONSE_CACHE_SIZE = 1024
+
+# Seconds a cached answer is reused before it is regenerated
+RESPONSE_CACHE_TTL = 3600
+
+# Max number of normalized queries whose FAQ match is memoized
+FAQ_MATCH_CACHE_SIZE = 4096
+
+# Minimum fuzzy score (0-100) / cosine similarity (0-1) for a FAQ to count as a match
+FAQ_FUZZY_CUTOFF = 60
+FAQ_SEMANTIC_CUTOFF = 0.6
+
+# With more candidate FAQs than this, rank by QRatio first and rescore only the top ones
+FAQ_PREFILTER_TOP_K = 8
+
+# After this many consecutive failed model calls, skip the model for the cooldown (seconds)
+LLM_BREAKER_THRESHOLD = 5
+LLM_BREAKER_COOLDOWN = 30.0
+
+# Max in-flight model calls while bulk_answer pre-warms the cache
+BULK_CONCURRENCY = 8
+
+# Small-talk messages answered with a canned reply. The whole message must match
+# (so "hi, my order is late" still goes through the normal flow); the group name
+# selects the reply in SMALL_TALK_RESPONSES.
+_SMALL_TALK_RE = re.compile(
+    r"(?:(?P<greeting>hi+|hello|hey|hola|yo|hiya|good\s+(?:morning|afternoon|evening))"
+    r"|(?P<thanks>thanks|thank\s+you|thx|ty)"
+    r"|(?P<bye>bye|goodbye|see\s+you))"
+    r"[\s!.]*",
+    re.IGNORECASE,
+)
+GREETING_RESPONSE = AgentResponse(
+    "Hi there! 👋 I'm your assistant — how can I help today?",
+    False,
+    None,
+    ("Check FAQs", "Report an issue", "Talk to a human"),
+)
+SMALL_TALK_RESPONSES = {
+    "greeting": GREETING_RESPONSE,
+    "thanks": AgentResponse("You're welcome! Is there anything else I can help you with?", False, None, None),
+    "bye": AgentResponse("Goodbye! If you have more questions later, just start a new chat. 👋", False, None, None),
+}
+
+# Quick-action suggestions offered with the generic fallback reply
+_FALLBACK_SUGGESTIONS = ("Show FAQs", "Talk to human")
+
+# Substrings that send a query straight to a human agent
+_ESCALATION_KEYWORDS = (
+    "urgent",
+    "critical",
+    "emergency",
+    "asap",
+    "immediately",
+    "broken",
+    "not working",
+    "error",
+    "angry",
+    "refund",
+    "cancel",
+    "speak to",
+    "human",
+    "manager",
+    "lawsuit",
+)
+_ESCALATION_RE = re.compile("|".join(map(re.escape, _ESCALATION_KEYWORDS)), re.IGNORECASE)
+
+# Single-pass Aho-Corasick automaton over the keywords when pyahocorasick is
+# installed; the compiled regex above is the fallback
+try:
+    import ahocorasick  # type: ignore
+
+    _ESCALATION_AUTOMATON = ahocorasick.Automaton()
+    for _keyword in _ESCALATION_KEYWORDS:
+        _ESCALATION_AUTOMATON.add_word(_keyword, _keyword)
+    _ESCALATION_AUTOMATON.make_automaton()
+except Exception:
+    _ESCALATION_AUTOMATON = None
+
+
+# (method name, argument shape) pairs tried on a GenerativeModel instance
+_MODEL_CALL_VARIANTS = (
+    ("generate_content", "prompt"),
+    ("generate_content", "input"),
+    ("generate_content", "messages"),
+    ("generateContent", "prompt"),
+    ("generateContent", "input"),
+    ("generateContent", "messages"),
+    ("generate_text", "prompt"),
+    ("generate_text", "text"),
+    ("generate_text", "input"),
+    ("generateText", "text"),
+    ("generate", "prompt"),
+    ("generate", "input"),
+    ("create", "prompt"),
+)
+
+# (function name, argument shape) pairs tried on the genai module, with model= passed
+_MODULE_CALL_VARIANTS = (
+    ("generate_content", "prompt"),
+    ("generate_content", "input"),
+    ("generate_content", "messages"),
+    ("generateContent", "prompt"),
+    ("generate_text", "prompt"),
+    ("generate_text", "text"),
+    ("generate_text", "input"),
+    ("generate", "prompt"),
+    ("generate", "input"),
+    ("create", "prompt"),
+)
+
+
+def _build_call_args(shape: str, prompt: str, model_name: Optional[str] = None):
+    """Positional tuple or kwargs dict for one call shape."""
+    if shape == "positional":
+        return (prompt,)
+    if shape == "messages":
+        args = {"messages": [{"role": "user", "content": prompt}]}
+    else:
+        args = {shape: prompt}
+    if model_name is not None:
+        args["model"] = model_name
+    return args
+
+
+def _async_variant(func: Callable[..., Any]) -> Optional[Callable[..., Any]]:
+    """The SDK's `<name>_async` counterpart of a bound method, if it has one."""
+    owner = getattr(func, "__self__", None)
+    name = getattr(func, "__name__", None)
+    if owner is None or not name:
+        return None
+    return getattr(owner, f"{name}_async", None)
+
+
+@lru_cache(maxsize=None)
+def _signature(func: Callable[..., Any]) -> Optional[inspect.Signature]:
+    try:
+        return inspect.signature(func)
+    except (TypeError, ValueError):
+        return None
+
+
+def _accepts_shape(func: Callable[..., Any], shape: str, model_name: Optional[str] = None) -> bool:
+    """
+    Whether func's signature can take this call shape. Lets the attempt list skip
+    calls that would only raise TypeError; unknown signatures are assumed compatible.
+    """
+    sig = _signature(func)
+    if sig is None:
+        return True
+    params = sig.parameters.values()
+    if shape == "positional":
+        return any(
+            p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD, p.VAR_POSITIONAL) for p in params
+        )
+    if any(p.kind is p.VAR_KEYWORD for p in params):
+        return True
+    names = {p.name for p in params if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)}
+    needed = {"messages" if shape == "messages" else shape}
+    if model_name is not None:
+        needed.add("model")
+    return needed.issubset(names)
+
+
+def _invoke(func: Callable[..., Any], args):
+    if isinstance(args, tuple):
+        return func(*args)
+    try:
+        return func(**args)
+    except TypeError:
+        return func(args)
+
+
+# keys probed (in order) for text inside dict-shaped responses
+_RESPONSE_TEXT_KEYS = ("text", "content", "output", "outputs", "candidates", "message", "messages")
+_PART_TEXT_KEYS = ("text", "content", "message")
+_CANDIDATE_TEXT_KEYS = ("output", "content", "text")
+
+
+def _first_str(d: dict, keys: Tuple[str, ...]) -> Optional[str]:
+    return next((d[k] for k in keys if isinstance(d.get(k), str)), None)
+
+
+def _text_from_dict(resp: dict) -> Optional[str]:
+    for key in _RESPONSE_TEXT_KEYS:
+        val = resp.get(key)
+        if isinstance(val, str):
+            return val
+        if isinstance(val, list) and val:
+            first = val[0]
+            if isinstance(first, dict):
+                return _first_str(first, _PART_TEXT_KEYS) or str(first)
+            if isinstance(first, str):
+                return first
+    return str(resp)
+
+
+def _text_from_outputs(resp) -> Optional[str]:
+    outputs = resp.outputs
+    if not outputs:
+        return None
+    out0 = outputs[0]
+    if isinstance(getattr(out0, "text", None), str):
+        return out0.text
+    content = getattr(out0, "content", None)
+    if isinstance(content, list) and content and isinstance(content[0], dict):
+        return _first_str(content[0], _PART_TEXT_KEYS)
+    return None
+
+
+def _text_from_candidates(resp) -> Optional[str]:
+    cands = resp.candidates
+    if not (isinstance(cands, list) and cands):
+        return None
+    cand0 = cands[0]
+    if isinstance(cand0, dict):
+        text = _first_str(cand0, _CANDIDATE_TEXT_KEYS)
+        if text:
+            return text
+    if isinstance(getattr(cand0, "text", None), str):
+        return cand0.text
+    return None
+
+
+# (predicate, extractor) pairs tried in order against an SDK response;
+# an extractor returning None passes the response on to the next pair
+_EXTRACTORS = (
+    (lambda r: isinstance(r, str), lambda r: r),
+    (lambda r: isinstance(getattr(r, "text", None), str), lambda r: r.text),
+    (lambda r: isinstance(getattr(r, "content", None), str), lambda r: r.content),
+    (lambda r: isinstance(r, dict), _text_from_dict),
+    (lambda r: hasattr(r, "outputs"), _text_from_outputs),
+    (lambda r: hasattr(r, "candidates"), _text_from_candidates),
+)
+
+
+# Response type -> extractor that last worked for it; an SDK returns the same
+# response class every time, so the predicate scan runs once per type
+_EXTRACTOR_BY_TYPE: Dict[type, Callable[[Any], Optional[str]]] = {}
+
+
+def _extract_text(resp) -> Optional[str]:
+    extract = _EXTRACTOR_BY_TYPE.get(type(resp))
+    if extract is not None:
+        try:
+            text = extract(resp)
+        except Exception:
+            text = None
+        if text is not None:
+            return text
+
+    for matches, extract in _EXTRACTORS:
+        if matches(resp):
+            text = extract(resp)
+            if text is not None:
+                _EXTRACTOR_BY_TYPE[type(resp)] = extract
+                return text
+    return None
+
+
+def _response_text(resp) -> Optional[str]:
+    text = _extract_text(resp)
+    if text:
+        return text
+    try:
+        s = str(resp)
+        if s and s.strip() and len(s.strip()) > 10:
+            return s.strip()
+    except Exception:
+        pass
+    return None
+
+
+def _specialize_call(
+    func: Callable[..., Any],
+    shape: str,
+    model_name: Optional[str],
+    extract: Optional[Callable[[Any], Optional[str]]],
+) -> Callable[[str], Optional[str]]:
+    """
+    prompt -> reply text for a call shape that already worked, with the argument
+    layout and the response extractor fixed up front instead of re-dispatched per call.
+    """
+    if shape == "positional":
+        send = func
+    else:
+        fixed = {"model": model_name} if model_name is not None else {}
+        if shape == "messages":
+            def send(prompt: str):
+                return _invoke(func, {"messages": [{"role": "user", "content": prompt}], **fixed})
+        else:
+            def send(prompt: str):
+                return _invoke(func, {shape: prompt, **fixed})
+
+    if extract is None:
+        return lambda prompt: _response_text(send(prompt))
+
+    def call(prompt: str) -> Optional[str]:
+        resp = send(prompt)
+        return extract(resp) or _response_text(resp)
+
+    return call
+
+
+def _discover_model_and_method() -> Tuple[Optional[str], Optional[str]]:
     """
     Query genai.list_models() and pick a model name and a supported method.
     If genai isn't available, return (None, None).
@@ -64,7 +449,7 @@ def _select_model_and_method() -> Tuple[Optional[str], Optional[str]]:
     try:
         models = genai.list_models()
     except Exception as e:
-        print("[agent_logic] list_models() failed:", repr(e))
+        logger.warning("list_models() failed: %r", e)
         return None, None
 
     candidates = []
@@ -97,305 +482,742 @@ def _select_model_and_method() -> Tuple[Optional[str], Optional[str]]:
     return None, None
 
 
-# Determine model+method once on import (if possible)
-_SELECTED_MODEL_NAME, _SELECTED_METHOD = _select_model_and_method()
+def _ensure_ready() -> None:
+    """Import the Gemini SDK and configure it once per process; safe to call from any thread."""
+    global genai, GEMINI_SDK_AVAILABLE, _INITIALIZED
+    with _INIT_LOCK:
+        if _INITIALIZED:
+            return
+        _INITIALIZED = True
+        try:
+            import google.generativeai as sdk  # type: ignore
+        except Exception as e:
+            logger.warning("google.generativeai not available: %r", e)
+            return
+        genai, GEMINI_SDK_AVAILABLE = sdk, True
+
+        # Configure genai only if key present
+        if GEMINI_API_KEY:
+            try:
+                genai.configure(api_key=GEMINI_API_KEY)
+            except Exception as e:
+                logger.warning("genai.configure failed: %r", e)
+                GEMINI_SDK_AVAILABLE = False
+
+
+def _is_rate_limited(err: Exception) -> bool:
+    """True for the API's HTTP 429 / RESOURCE_EXHAUSTED, whatever exception type the SDK wraps it in."""
+    return (
+        getattr(err, "code", None) == 429
+        or type(err).__name__ in ("ResourceExhausted", "TooManyRequests")
+        or "RESOURCE_EXHAUSTED" in str(err)
+    )
+
+
+def _check_rate_limit(err: Exception) -> None:
+    """Re-raise a 429 after backing off, so callers don't try other call shapes against an exhausted quota."""
+    if _is_rate_limited(err):
+        _RATE_LIMITER.penalize()
+        raise err
+
+
+def _estimate_tokens(prompt: str) -> int:
+    # ~4 characters per token for English text
+    return len(prompt) // 4
+
 
-if _SELECTED_MODEL_NAME:
+# Model+method are discovered on first use (list_models() is a network call), not on import
+_SELECTION_LOCK = threading.Lock()
+
+# The pick is also kept on disk so restarts/new workers skip list_models() for a day
+MODEL_CACHE_FILE = os.getenv("MODEL_CACHE_FILE", os.path.join(".cache", "gemini_model.json"))
+MODEL_CACHE_TTL = 24 * 3600
+
+
+def _model_cache_key() -> str:
+    # a different SDK version may expose different models/methods
+    return str(getattr(genai, "__version__", "unknown"))
+
+
+def _load_cached_model() -> Optional[Tuple[str, Optional[str]]]:
     try:
-        print(f"[agent_logic] Selected model: {_SELECTED_MODEL_NAME}  method: {_SELECTED_METHOD}")
-    except Exception:
-        pass
-else:
+        with open(MODEL_CACHE_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("sdk") != _model_cache_key() or time.time() - data.get("ts", 0) > MODEL_CACHE_TTL:
+        return None
+    if not data.get("model"):
+        return None
+    return data["model"], data.get("method")
+
+
+def _store_cached_model(model_name: str, method: Optional[str]) -> None:
     try:
-        print("[agent_logic] No suitable Gemini model found at startup; running in fallback mode.")
-    except Exception:
-        pass
+        os.makedirs(os.path.dirname(MODEL_CACHE_FILE) or ".", exist_ok=True)
+        tmp = f"{MODEL_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": model_name, "method": method, "sdk": _model_cache_key(), "ts": time.time()}, f)
+        os.replace(tmp, MODEL_CACHE_FILE)
+    except OSError as e:
+        logger.warning("could not write model cache %s: %r", MODEL_CACHE_FILE, e)
+
+
+@lru_cache(maxsize=1)
+def _select_model_and_method() -> Tuple[Optional[str], Optional[str]]:
+    if not GEMINI_SDK_AVAILABLE:
+        return None, None
+    cached = _load_cached_model()
+    if cached is not None:
+        logger.info("Selected model (cached): %s  method: %s", *cached)
+        return cached
+
+    model_name, method = _discover_model_and_method()
+    if model_name:
+        _store_cached_model(model_name, method)
+        logger.info("Selected model: %s  method: %s", model_name, method)
+    else:
+        logger.info("No suitable Gemini model found; running in fallback mode.")
+    return model_name, method
+
+
+def _selected_model() -> Tuple[Optional[str], Optional[str]]:
+    """(model name, method) picked once per process; concurrent first callers share one lookup."""
+    with _SELECTION_LOCK:
+        return _select_model_and_method()
+
+
+def small_talk_reply(query: str) -> Optional[AgentResponse]:
+    """Canned reply when the whole message is a greeting, thanks or goodbye; None otherwise."""
+    match = _SMALL_TALK_RE.fullmatch(query.strip())
+    return SMALL_TALK_RESPONSES[match.lastgroup] if match else None
+
+
+def build_faq_index(faq_database) -> Optional[FaqIndex]:
+    """Embedding index over the FAQ questions, or None when SEMANTIC_FAQ is off or it can't be built."""
+    if not (SEMANTIC_FAQ_ENABLED and faq_database):
+        return None
+    try:
+        return FaqIndex([faq.get("question", "") for faq in faq_database])
+    except Exception as e:
+        logger.warning("semantic FAQ matching disabled: %r", e)
+        return None
+
+
+class _GeminiContextCache:
+    """
+    Gemini cached content holding the static system instruction and FAQ corpus.
+    Created on first use and its TTL extended when close to expiry; if creation
+    fails (e.g. content below the API's minimum size) it is retried after one TTL.
+    """
+
+    def __init__(self, model_name: str, system_instruction: str, corpus: str):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.corpus = corpus
+        self._cache = None
+        self._model = None
+        self._retry_at = datetime.min.replace(tzinfo=timezone.utc)
+        self._lock = threading.Lock()
+
+    def model(self):
+        """GenerativeModel bound to the cached content, or None if unavailable."""
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            if self._cache is None:
+                if now < self._retry_at:
+                    return None
+                try:
+                    self._cache = genai.caching.CachedContent.create(
+                        model=self.model_name,
+                        system_instruction=self.system_instruction,
+                        contents=[self.corpus],
+                        ttl=CONTEXT_CACHE_TTL,
+                    )
+                    self._model = genai.GenerativeModel.from_cached_content(cached_content=self._cache)
+                except Exception as e:
+                    logger.warning("Gemini context cache unavailable: %r", e)
+                    self._cache, self._model = None, None
+                    self._retry_at = now + CONTEXT_CACHE_TTL
+                    return None
+            else:
+                expire_time = getattr(self._cache, "expire_time", None)
+                if expire_time is not None and expire_time - now < CONTEXT_CACHE_RENEW_BEFORE:
+                    try:
+                        self._cache.update(ttl=CONTEXT_CACHE_TTL)
+                    except Exception as e:
+                        logger.warning("Gemini context cache renewal failed: %r", e)
+                        self._cache, self._model = None, None
+                        return None
+            return self._model
 
 
 class SupportAgent:
-    def __init__(self, faq_database):
+    def __init__(
+        self,
+        faq_database,
+        cache_db: Optional[str] = RESPONSE_CACHE_DB,
+        faq_index: Optional[FaqIndex] = None,
+        model_gate: Optional[ContextManager[Any]] = None,
+    ):
+        _ensure_ready()
         self.faq_db = faq_database
+        # questions normalized once (lowercase, punctuation stripped) so the per-query
+        # scan compares against ready-made strings with no processor
+        self._faq_questions_norm = [default_process(faq.get("question", "")) for faq in self.faq_db]
+        # inverted index token -> FAQ indices; queries sharing no token with any question skip the fuzzy scan
+        self._faq_postings: Dict[str, List[int]] = {}
+        for i, question in enumerate(self._faq_questions_norm):
+            for token in set(question.split()):
+                self._faq_postings.setdefault(token, []).append(i)
+        # a prebuilt index (e.g. shared by the Streamlit app) skips embedding the questions again
+        self.faq_index = faq_index if faq_index is not None else build_faq_index(self.faq_db)
+        # FAQ replies and prompt context rendered once, indexed like faq_db
+        self._faq_high_conf_reply = [
+            AgentResponse(
+                f"Based on our knowledge base:\n\nQ: {faq.get('question')}\nA: {faq.get('answer')}\n\n"
+                "Would you like more details or to talk to a human?",
+                False,
+                None,
+                None,
+            )
+            for faq in self.faq_db
+        ]
+        self._faq_medium_conf_reply = [
+            AgentResponse(
+                f"It looks like this FAQ might help:\n\nQ: {faq.get('question')}\nA: {faq.get('answer')}\n\n"
+                "If that doesn't answer your question, reply and I'll connect you to support.",
+                False,
+                None,
+                None,
+            )
+            for faq in self.faq_db
+        ]
+        self._faq_context = [f"FAQ: {faq.get('question')}\nAnswer: {faq.get('answer')}" for faq in self.faq_db]
+        # FAQ matching is pure per normalized query, so memoize it per agent
+        self._match_faq = lru_cache(maxsize=FAQ_MATCH_CACHE_SIZE)(self._match_faq)
         self.escalation_threshold = 0.6
-        self.model_name = _SELECTED_MODEL_NAME
-        self.method_name = _SELECTED_METHOD
-        # llm_available only if SDK + key + selected model exist
-        self.llm_available = bool(GEMINI_SDK_AVAILABLE and GEMINI_API_KEY and self.model_name)
+        # exact-match LRU cache: normalized query -> (expires_at, AgentResponse). Escalations and
+        # fallbacks after a failed/unavailable model call are never cached.
+        self._response_cache: "OrderedDict[str, Tuple[float, AgentResponse]]" = OrderedDict()
+        # one agent may serve several sessions/threads (e.g. Streamlit's cache_resource)
+        self._cache_lock = threading.Lock()
+        self._response_store: Optional[KVCache] = None
+        if cache_db:
+            try:
+                self._response_store = KVCache(cache_db, ttl=RESPONSE_CACHE_TTL)
+            except Exception as e:
+                logger.warning("persistent response cache disabled: %r", e)
+        # (callable, argument shape, model kwarg) that last produced text, tried first
+        self._winning_call: Optional[Tuple[Callable[..., Any], str, Optional[str]]] = None
+        # the same call as one closure from prompt to reply text (see _specialize_call)
+        self._fast_call: Optional[Callable[[str], Optional[str]]] = None
+        # held around each blocking model request (e.g. a semaphore shared by every session)
+        self._model_gate = model_gate if model_gate is not None else contextlib.nullcontext()
+        # circuit breaker state for the model path (see LLM_BREAKER_*)
+        self._model_failures = 0
+        self._breaker_opened_at = 0.0
+        # per-event-loop micro-batcher for process_query_async (see LLM_BATCHING)
+        self._batcher: Optional[Tuple[asyncio.AbstractEventLoop, BatchScheduler]] = None
+        self.semantic_cache: Optional[SemanticCache] = None
+        if SEMANTIC_CACHE_ENABLED:
+            try:
+                self.semantic_cache = SemanticCache(path=cache_db, ttl=RESPONSE_CACHE_TTL)
+            except Exception as e:
+                logger.warning("semantic cache disabled: %r", e)
         self.system_instruction = (
             "You are a friendly, expert AI assistant. Answer conversationally like ChatGPT. "
             "Ask clarification questions when helpful and offer follow-up help."
         )
 
-        if not self.llm_available:
-            print("[agent_logic] LLM is NOT available. Agent will use FAQ/local fallbacks.")
+        if GEMINI_SDK_AVAILABLE and GEMINI_API_KEY:
+            # warm model selection in the background; first model call waits for it if needed
+            threading.Thread(target=_selected_model, daemon=True).start()
+        else:
+            logger.info("LLM is NOT available. Agent will use FAQ/local fallbacks.")
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return _selected_model()[0]
+
+    @property
+    def method_name(self) -> Optional[str]:
+        return _selected_model()[1]
+
+    @property
+    def llm_available(self) -> bool:
+        # only if SDK + key + selected model exist
+        return bool(GEMINI_SDK_AVAILABLE and GEMINI_API_KEY and self.model_name)
 
     # -----------------------
     # helpers
     # -----------------------
-    def _is_greeting(self, query: str) -> bool:
-        return query.strip().lower() in {"hi", "hello", "hey", "hii", "hola", "yo", "hiya"}
-
     def find_matching_faq(self, query: str) -> Tuple[Optional[dict], float]:
-        best_match = None
-        best_score = 0
-        q = query.lower()
-        for faq in self.faq_db:
-            score = fuzz.token_set_ratio(q, faq.get("question", "").lower())
-            if score > best_score:
-                best_score = score
-                best_match = faq
-        if best_score >= 60:
-            return best_match, best_score / 100.0
-        return None, 0.0
+        idx, confidence = self._match_faq(query)
+        if idx is None:
+            return None, 0.0
+        return self.faq_db[idx], confidence
+
+    def _match_faq(self, query: str) -> Tuple[Optional[int], float]:
+        """(index into faq_db, confidence 0-1) of the best FAQ, or (None, 0.0)."""
+        best_idx, best_conf = None, 0.0
+        q = default_process(query)
+        candidates = {i for token in set(q.split()) for i in self._faq_postings.get(token, ())}
+        match = None
+        if candidates:
+            choices = {i: self._faq_questions_norm[i] for i in sorted(candidates)}
+            if len(choices) > FAQ_PREFILTER_TOP_K:
+                # cheap QRatio pass keeps the top-K; only those get the costlier token_set_ratio
+                top = process.extract(q, choices, scorer=fuzz.QRatio, processor=None, limit=FAQ_PREFILTER_TOP_K)
+                choices = {i: choices[i] for i in sorted(key for _, _, key in top)}
+            match = process.extractOne(
+                q,
+                choices,
+                scorer=fuzz.token_set_ratio,
+                processor=None,
+                score_cutoff=FAQ_FUZZY_CUTOFF,
+            )
+        if match is not None:
+            _, score, best_idx = match
+            best_conf = score / 100.0
+
+        # Embedding similarity catches paraphrases; keep whichever match is stronger
+        if self.faq_index is not None:
+            hit = self.faq_index.search(query)
+            if hit is not None and hit[1] >= FAQ_SEMANTIC_CUTOFF and hit[1] > best_conf:
+                best_idx, best_conf = hit
+
+        if best_idx is None:
+            return None, 0.0
+        return best_idx, best_conf
+
+    def rank_batch(self, queries: Sequence[str]):
+        """
+        Fuzzy scores of every query against every FAQ question as a
+        (len(queries), len(faq_db)) uint8 matrix, computed in one vectorized
+        call across all cores. For offline evaluation / warm-up; needs numpy.
+        """
+        import numpy as np
+
+        return process.cdist(
+            [default_process(q) for q in queries],
+            self._faq_questions_norm,
+            scorer=fuzz.token_set_ratio,
+            processor=None,
+            dtype=np.uint8,
+            workers=-1,
+        )
+
+    def _cache_get(self, key: str) -> Optional[AgentResponse]:
+        with self._cache_lock:
+            cached = self._response_cache.get(key)
+            if cached is not None:
+                expires_at, response = cached
+                if expires_at > time.monotonic():
+                    self._response_cache.move_to_end(key)
+                    return response
+                del self._response_cache[key]
+        if self._response_store is not None:
+            stored = self._response_store.get(key)
+            if stored is not None:
+                return self._remember(key, AgentResponse(*stored))
+        return None
+
+    def _remember(self, key: str, response: AgentResponse) -> AgentResponse:
+        with self._cache_lock:
+            self._response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, response)
+            self._response_cache.move_to_end(key)
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+        return response
+
+    def _cache_put(self, key: str, response: AgentResponse) -> AgentResponse:
+        if self._response_store is not None:
+            try:
+                self._response_store.set(key, response)
+            except Exception as e:
+                logger.warning("response cache write failed: %r", e)
+        return self._remember(key, response)
 
     def detect_escalation_keywords(self, query: str) -> bool:
-        keywords = [
-            "urgent",
-            "critical",
-            "emergency",
-            "asap",
-            "immediately",
-            "broken",
-            "not working",
-            "error",
-            "angry",
-            "refund",
-            "cancel",
-            "speak to",
-            "human",
-            "manager",
-            "lawsuit",
-        ]
-        q = query.lower()
-        return any(k in q for k in keywords)
+        if _ESCALATION_AUTOMATON is not None:
+            return next(_ESCALATION_AUTOMATON.iter(query.lower()), None) is not None
+        return _ESCALATION_RE.search(query) is not None
 
     # -----------------------
     # call Gemini robustly (only used if llm_available True)
     # -----------------------
-    def _call_model(self, prompt: str) -> str:
-        if not self.llm_available:
-            raise RuntimeError("Gemini model not configured or API key missing")
-
-        # instantiate model object where possible
-        model = None
+    @cached_property
+    def _model(self):
+        """One GenerativeModel per agent, so the SDK client and its connections are reused."""
         try:
-            model = genai.GenerativeModel(self.model_name)
+            return genai.GenerativeModel(self.model_name)
         except Exception:
-            model = None
-
-        def _extract_text(resp):
-            if isinstance(resp, str):
-                return resp
-            if hasattr(resp, "text") and isinstance(resp.text, str):
-                return resp.text
-            if hasattr(resp, "content") and isinstance(resp.content, str):
-                return resp.content
-            if isinstance(resp, dict):
-                for k in ("text", "content", "output", "outputs", "candidates", "message", "messages"):
-                    if k in resp:
-                        val = resp[k]
-                        if isinstance(val, list) and val:
-                            first = val[0]
-                            if isinstance(first, dict):
-                                for kk in ("text", "content", "message"):
-                                    if kk in first and isinstance(first[kk], str):
-                                        return first[kk]
-                                try:
-                                    return str(first)
-                                except Exception:
-                                    pass
-                            elif isinstance(first, str):
-                                return first
-                        elif isinstance(val, str):
-                            return val
-                try:
-                    return str(resp)
-                except Exception:
-                    pass
-            if hasattr(resp, "outputs"):
-                outputs = getattr(resp, "outputs")
-                if outputs:
-                    out0 = outputs[0]
-                    if hasattr(out0, "text") and isinstance(out0.text, str):
-                        return out0.text
-                    if hasattr(out0, "content"):
-                        try:
-                            c = out0.content
-                            if isinstance(c, list) and c:
-                                first = c[0]
-                                if isinstance(first, dict):
-                                    for kk in ("text", "content", "message"):
-                                        if kk in first and isinstance(first[kk], str):
-                                            return first[kk]
-                        except Exception:
-                            pass
-            if hasattr(resp, "candidates"):
-                cands = getattr(resp, "candidates")
-                if isinstance(cands, list) and cands:
-                    cand0 = cands[0]
-                    if isinstance(cand0, dict):
-                        for kk in ("output", "content", "text"):
-                            if kk in cand0 and isinstance(cand0[kk], str):
-                                return cand0[kk]
-                    if hasattr(cand0, "text") and isinstance(cand0.text, str):
-                        return cand0.text
             return None
 
+    @cached_property
+    def _call_attempts(self) -> List[Tuple[Callable[..., Any], str, Optional[str]]]:
+        """
+        Every (callable, argument shape, model kwarg) combination worth trying against
+        the installed SDK. Built once per agent instead of on every call.
+        """
         attempts = []
 
+        model = self._model
         if model is not None:
-            method_variants = [
-                ("generate_content", {"prompt": prompt}),
-                ("generate_content", {"input": prompt}),
-                ("generate_content", {"messages": [{"role": "user", "content": prompt}]}),
-                ("generateContent", {"prompt": prompt}),
-                ("generateContent", {"input": prompt}),
-                ("generateContent", {"messages": [{"role": "user", "content": prompt}]}),
-                ("generate_text", {"prompt": prompt}),
-                ("generate_text", {"text": prompt}),
-                ("generate_text", {"input": prompt}),
-                ("generateText", {"text": prompt}),
-                ("generate", {"prompt": prompt}),
-                ("generate", {"input": prompt}),
-                ("create", {"prompt": prompt}),
-            ]
-
-            for method, kwargs in method_variants:
+            for method, shape in _MODEL_CALL_VARIANTS:
                 if hasattr(model, method):
-                    func = getattr(model, method)
-                    attempts.append((func, kwargs))
-            for method, _ in method_variants:
+                    attempts.append((getattr(model, method), shape, None))
+            for method in dict.fromkeys(method for method, _ in _MODEL_CALL_VARIANTS):
                 if hasattr(model, method):
-                    func = getattr(model, method)
-                    attempts.append((func, (prompt,)))
-
-        top_level_variants = [
-            ("generate_content", {"model": self.model_name, "prompt": prompt}),
-            ("generate_content", {"model": self.model_name, "input": prompt}),
-            ("generate_content", {"model": self.model_name, "messages": [{"role": "user", "content": prompt}]}),
-            ("generateContent", {"model": self.model_name, "prompt": prompt}),
-            ("generate_text", {"model": self.model_name, "prompt": prompt}),
-            ("generate_text", {"model": self.model_name, "text": prompt}),
-            ("generate_text", {"model": self.model_name, "input": prompt}),
-            ("generate", {"model": self.model_name, "prompt": prompt}),
-            ("generate", {"model": self.model_name, "input": prompt}),
-            ("create", {"model": self.model_name, "prompt": prompt}),
-        ]
-        for fname, kwargs in top_level_variants:
+                    attempts.append((getattr(model, method), "positional", None))
+
+        for fname, shape in _MODULE_CALL_VARIANTS:
             if GEMINI_SDK_AVAILABLE and hasattr(genai, fname):
-                attempts.append((getattr(genai, fname), kwargs))
+                attempts.append((getattr(genai, fname), shape, self.model_name))
 
-        generic_fallbacks = [
-            (getattr(genai, "generate", None), {"model": self.model_name, "prompt": prompt}) if GEMINI_SDK_AVAILABLE else (None, None),
-            (getattr(genai, "generate_text", None), {"model": self.model_name, "prompt": prompt}) if GEMINI_SDK_AVAILABLE else (None, None),
-            (getattr(genai, "generate_content", None), {"model": self.model_name, "prompt": prompt}) if GEMINI_SDK_AVAILABLE else (None, None),
-        ]
-        for f, kw in generic_fallbacks:
-            if f:
-                attempts.append((f, kw))
+        # drop shapes the callable's signature can't take instead of raising per call
+        return [attempt for attempt in attempts if _accepts_shape(*attempt)]
+
+    @cached_property
+    def _context_cache(self) -> Optional[_GeminiContextCache]:
+        if not (GEMINI_CONTEXT_CACHE_ENABLED and self.model_name):
+            return None
+        return _GeminiContextCache(self.model_name, self.system_instruction, "\n\n".join(self._faq_context))
+
+    def _user_turn(self, prompt: str) -> str:
+        """The prompt minus the system instruction, which the context cache already holds."""
+        prefix = self.system_instruction + "\n\n"
+        return prompt[len(prefix):] if prompt.startswith(prefix) else prompt
+
+    def _call_model(self, prompt: str) -> str:
+        if not self.llm_available:
+            raise RuntimeError("Gemini model not configured or API key missing")
+        with self._model_gate:
+            _RATE_LIMITER.acquire(_estimate_tokens(prompt))
+            return self._call_model_unthrottled(prompt)
+
+    def _call_model_unthrottled(self, prompt: str) -> str:
+        context_model = self._context_cache.model() if self._context_cache is not None else None
+        if context_model is not None:
+            try:
+                text = _response_text(context_model.generate_content(self._user_turn(prompt)))
+                if text:
+                    return text
+            except Exception as e:
+                _check_rate_limit(e)
+                logger.warning("cached-context call failed: %r", e)
+
+        # Fast path: the call specialized for the shape that worked last time
+        if self._fast_call is not None:
+            try:
+                text = self._fast_call(prompt)
+                if text:
+                    return text
+            except Exception as e:
+                _check_rate_limit(e)
+            self._winning_call = self._fast_call = None
 
         errors = []
-        for func, args in attempts:
-            if not func:
-                continue
+        for attempt in self._call_attempts:
+            func, shape, model_kw = attempt
             try:
-                if isinstance(args, tuple):
-                    resp = func(*args)
-                elif isinstance(args, dict):
-                    try:
-                        resp = func(**args)
-                    except TypeError:
-                        try:
-                            resp = func(args)
-                        except Exception:
-                            raise
-                else:
-                    resp = func(prompt)
+                resp = _invoke(func, _build_call_args(shape, prompt, model_kw))
             except Exception as e:
+                _check_rate_limit(e)
                 errors.append(e)
                 continue
 
-            text = _extract_text(resp)
+            text = _response_text(resp)
             if text:
+                self._winning_call = attempt
+                self._fast_call = _specialize_call(func, shape, model_kw, _EXTRACTOR_BY_TYPE.get(type(resp)))
                 return text
-            try:
-                s = str(resp)
-                if s and s.strip() and len(s.strip()) > 10:
-                    return s.strip()
-            except Exception:
-                pass
 
         last_err = errors[-1] if errors else None
         raise RuntimeError(f"All model call attempts failed. Last error: {repr(last_err)}")
 
+    def _stream_model(self, prompt: str) -> Iterator[str]:
+        """
+        Text chunks of one streamed generate_content call (the cached-context model
+        when available). If streaming fails before any text arrives, the regular
+        resilient call runs instead and its answer is yielded as a single chunk.
+        """
+        if not self.llm_available:
+            raise RuntimeError("Gemini model not configured or API key missing")
+        with self._model_gate:
+            _RATE_LIMITER.acquire(_estimate_tokens(prompt))
+
+            model = self._context_cache.model() if self._context_cache is not None else None
+            stream_prompt = self._user_turn(prompt) if model is not None else prompt
+            model = model or self._model
+
+            streamed = False
+            if model is not None:
+                try:
+                    for chunk in model.generate_content(stream_prompt, stream=True):
+                        text = _extract_text(chunk)
+                        if text:
+                            streamed = True
+                            yield text
+                except Exception as e:
+                    _check_rate_limit(e)
+                    if streamed:
+                        raise
+                    logger.warning("streaming call failed, retrying without streaming: %r", e)
+            if not streamed:
+                yield self._call_model_unthrottled(prompt)
+
+    async def _call_model_async(self, prompt: str) -> str:
+        if not self.llm_available:
+            raise RuntimeError("Gemini model not configured or API key missing")
+
+        if LLM_BATCHING_ENABLED:
+            loop = asyncio.get_running_loop()
+            if self._batcher is None or self._batcher[0] is not loop:
+                self._batcher = (loop, BatchScheduler(self._call_model_unbatched_async))
+            return await self._batcher[1].submit(prompt)
+        return await self._call_model_unbatched_async(prompt)
+
+    async def _call_model_unbatched_async(self, prompt: str) -> str:
+        await _RATE_LIMITER.acquire_async(_estimate_tokens(prompt))
+        if self._context_cache is not None:
+            context_model = await asyncio.to_thread(self._context_cache.model)
+            if context_model is not None:
+                try:
+                    text = _response_text(await context_model.generate_content_async(self._user_turn(prompt)))
+                    if text:
+                        return text
+                except Exception as e:
+                    _check_rate_limit(e)
+                    logger.warning("cached-context call failed: %r", e)
+
+        # Await the SDK's native async twin (e.g. generate_content_async) of the
+        # call shape that already works
+        if self._winning_call is not None:
+            func, shape, model_kw = self._winning_call
+            async_func = _async_variant(func)
+            if async_func is not None:
+                try:
+                    text = _response_text(await _invoke(async_func, _build_call_args(shape, prompt, model_kw)))
+                    if text:
+                        return text
+                except Exception as e:
+                    _check_rate_limit(e)
+        elif self._model is not None and hasattr(self._model, "generate_content_async"):
+            # nothing resolved yet: try the shared model's async call before probing
+            try:
+                text = _response_text(await self._model.generate_content_async(prompt))
+                if text:
+                    return text
+            except Exception as e:
+                _check_rate_limit(e)
+
+        # Otherwise resolve/run the blocking call off the event loop (budget already taken above)
+        return await asyncio.to_thread(self._call_model_unthrottled, prompt)
+
     # -----------------------
     # main logic
     # -----------------------
-    def process_query(self, user_query: str) -> Tuple[str, bool, Optional[str], Optional[List[str]]]:
+    def _route(self, user_query: str) -> Tuple[Optional[AgentResponse], Optional[_ModelRequest]]:
+        """
+        Everything that can be answered without the model. Returns (response, None) when
+        the query is handled locally, otherwise (None, request) describing the model call.
+        """
         q = (user_query or "").strip()
         if not q:
-            return "Please type your question so I can help you.", False, None, None
+            return AgentResponse("Please type your question so I can help you.", False, None, None), None
 
-        # Instant greetings
-        if self._is_greeting(q):
-            return (
-                "Hi there! 👋 I'm your assistant — how can I help today?",
-                False,
-                None,
-                ["Check FAQs", "Report an issue", "Talk to a human"],
-            )
+        # Lowercased once; reused as cache key and by every check below
+        ql = q.lower()
+
+        # Instant greetings / thanks / goodbyes
+        canned = small_talk_reply(q)
+        if canned is not None:
+            return canned, None
+
+        # Repeated questions are answered from the exact-match cache
+        cache_key = ql
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached, None
 
         # Escalation detection
-        if self.detect_escalation_keywords(q):
-            return (
+        if self.detect_escalation_keywords(ql):
+            return AgentResponse(
                 "This looks urgent. I'm escalating this to a human support agent.",
                 True,
                 "Contains urgent/critical keywords",
                 None,
-            )
+            ), None
 
         # FAQ matching
-        faq, confidence = self.find_matching_faq(q)
-        faq_context = None
-        if faq:
-            faq_context = f"FAQ: {faq.get('question')}\nAnswer: {faq.get('answer')}"
-
-        # If high-confidence FAQ, return directly
-        if faq and confidence >= 0.75:
-            reply = (
-                f"Based on our knowledge base:\n\nQ: {faq.get('question')}\nA: {faq.get('answer')}\n\n"
-                "Would you like more details or to talk to a human?"
-            )
-            return reply, False, None, None
+        faq_idx, confidence = self._match_faq(ql)
+
+        # If high-confidence FAQ, return the pre-rendered reply directly. Not cached: it is
+        # already instant, and a persisted copy would outlive edits to the FAQ database
+        if faq_idx is not None and confidence >= 0.75:
+            return self._faq_high_conf_reply[faq_idx], None
 
         # Prepare prompt for model
         prompt = self.system_instruction + "\n\n"
-        if faq_context:
-            prompt += f"Relevant FAQ context:\n{faq_context}\n\n"
+        if faq_idx is not None:
+            prompt += f"Relevant FAQ context:\n{self._faq_context[faq_idx]}\n\n"
         prompt += f"User: {q}\nAssistant:"
 
-        # Try to call model; if fails, fallback gracefully
-        if self.llm_available:
-            try:
-                answer_text = self._call_model(prompt)
-                if answer_text and answer_text.strip():
-                    return answer_text.strip(), False, None, None
-            except Exception as e:
-                try:
-                    print("[agent_logic] model call failed:", repr(e))
-                except Exception:
-                    pass
+        return None, _ModelRequest(q, cache_key, prompt, faq_idx, confidence)
+
+    def _breaker_open(self) -> bool:
+        """True while repeated model failures say to go straight to the fallbacks."""
+        return (
+            self._model_failures >= LLM_BREAKER_THRESHOLD
+            and time.monotonic() - self._breaker_opened_at < LLM_BREAKER_COOLDOWN
+        )
+
+    def _record_model_result(self, answer_text: Optional[str]) -> None:
+        if answer_text and answer_text.strip():
+            self._model_failures = 0
+            return
+        self._model_failures += 1
+        self._breaker_opened_at = time.monotonic()
+        if self._model_failures == LLM_BREAKER_THRESHOLD:
+            logger.warning("model failed %d times in a row; using fallbacks for %.0fs", self._model_failures, LLM_BREAKER_COOLDOWN)
+
+    def _semantic_lookup(self, request: _ModelRequest):
+        """(query embedding, reused answer) from the semantic cache, or (None, None) when it is off."""
+        if self.semantic_cache is None:
+            return None, None
+        query_vec = self.semantic_cache.embed(request.query)
+        return query_vec, self.semantic_cache.lookup(query_vec)
+
+    def _finish(self, request: _ModelRequest, answer_text: Optional[str], query_vec=None) -> AgentResponse:
+        """Turn the model answer (None if unavailable/failed) into the final response."""
+        if answer_text and answer_text.strip():
+            if query_vec is not None:
+                self.semantic_cache.add(query_vec, answer_text.strip(), query=request.query)
+            return self._cache_put(request.cache_key, AgentResponse(answer_text.strip(), False, None, None))
 
         # Medium-confidence FAQ fallback
-        if faq and confidence >= 0.5:
-            reply = (
-                f"It looks like this FAQ might help:\n\nQ: {faq.get('question')}\nA: {faq.get('answer')}\n\n"
-                "If that doesn't answer your question, reply and I'll connect you to support."
-            )
-            return reply, False, None, None
+        if request.faq_idx is not None and request.confidence >= 0.5:
+            return self._faq_medium_conf_reply[request.faq_idx]
 
         # Generic fallback when model unavailable
         fallback = (
             "Sorry — I can't generate a full answer right now. I can show relevant FAQs or connect you to human support. "
             "Which would you prefer?"
         )
-        return fallback, False, None, ["Show FAQs", "Talk to human"]
+        return AgentResponse(fallback, False, None, _FALLBACK_SUGGESTIONS)
+
+    def process_query(self, user_query: str) -> AgentResponse:
+        response, request = self._route(user_query)
+        if response is not None:
+            return response
+
+        # Try to call model; if fails, fallback gracefully
+        answer_text, query_vec = None, None
+        if self.llm_available:
+            # A close paraphrase of an already-answered question reuses that answer
+            query_vec, reused = self._semantic_lookup(request)
+            if reused is not None:
+                return self._cache_put(request.cache_key, AgentResponse(reused, False, None, None))
+            if not self._breaker_open():
+                try:
+                    answer_text = self._call_model(request.prompt)
+                except Exception as e:
+                    logger.warning("model call failed: %r", e)
+                self._record_model_result(answer_text)
+
+        return self._finish(request, answer_text, query_vec)
+
+    def process_query_stream(self, user_query: str) -> StreamingAgentResponse:
+        """
+        Same routing as process_query, but a model answer is returned with `reply`
+        as an iterator of text chunks as Gemini generates them (every other reply
+        is a plain string). The first chunk is fetched before returning, so a
+        failing call still ends in the usual fallbacks; the answer is cached once
+        the iterator has been fully consumed.
+        """
+        response, request = self._route(user_query)
+        if response is not None:
+            return StreamingAgentResponse(*response)
+
+        query_vec = None
+        if self.llm_available:
+            query_vec, reused = self._semantic_lookup(request)
+            if reused is not None:
+                return StreamingAgentResponse(*self._cache_put(request.cache_key, AgentResponse(reused, False, None, None)))
+            if not self._breaker_open():
+                chunks = self._stream_model(request.prompt)
+                try:
+                    first = next(chunks)
+                except StopIteration:
+                    first = None
+                except Exception as e:
+                    logger.warning("model call failed: %r", e)
+                    first = None
+                if first is not None:
+                    return StreamingAgentResponse(self._relay_stream(request, first, chunks, query_vec), False, None, None)
+                self._record_model_result(None)
+
+        return StreamingAgentResponse(*self._finish(request, None, query_vec))
+
+    def _relay_stream(self, request: _ModelRequest, first: str, chunks: Iterator[str], query_vec) -> Iterator[str]:
+        parts = [first]
+        yield first
+        try:
+            for text in chunks:
+                parts.append(text)
+                yield text
+        except Exception as e:
+            # a cut-off answer is flagged to the reader, and neither cached nor counted as a success
+            logger.warning("model stream failed: %r", e)
+            self._record_model_result(None)
+            yield STREAM_INTERRUPTED_NOTICE
+            return
+        answer_text = "".join(parts)
+        self._record_model_result(answer_text)
+        self._finish(request, answer_text, query_vec)
+
+    async def process_query_async(self, user_query: str) -> AgentResponse:
+        """
+        Same result as process_query, but the model round-trip is awaited so one
+        event loop can serve many users while Gemini is generating. Routing and
+        finishing touch SQLite and may embed the query, so they run in a worker thread.
+        """
+        response, request = await asyncio.to_thread(self._route, user_query)
+        if response is not None:
+            return response
+
+        answer_text, query_vec = None, None
+        if self.llm_available:
+            query_vec, reused = await asyncio.to_thread(self._semantic_lookup, request)
+            if reused is not None:
+                return await asyncio.to_thread(
+                    self._cache_put, request.cache_key, AgentResponse(reused, False, None, None)
+                )
+            if not self._breaker_open():
+                try:
+                    answer_text = await self._call_model_async(request.prompt)
+                except Exception as e:
+                    logger.warning("model call failed: %r", e)
+                self._record_model_result(answer_text)
+
+        return await asyncio.to_thread(self._finish, request, answer_text, query_vec)
+
+    def bulk_answer(self, queries: Sequence[str], concurrency: int = BULK_CONCURRENCY) -> List[AgentResponse]:
+        """
+        Answer many queries offline (e.g. pre-warming the cache with common
+        questions). Model calls run concurrently, at most `concurrency` at a
+        time, and every answer lands in the response cache (and cache_db, if set)
+        so later live hits skip the model. Not for use inside a running event loop.
+        """
+        async def run() -> List[AgentResponse]:
+            gate = asyncio.Semaphore(concurrency)
+
+            async def one(query: str) -> AgentResponse:
+                async with gate:
+                    return await self.process_query_async(query)
+
+            return list(await asyncio.gather(*(one(q) for q in queries)))
+
+        return asyncio.run(run())
@@ -1,28 +1,12 @@
-# app.py - Streamlit chat app with quick-actions, safe_rerun, and End Chat / Restart Chat behavior
+# app.py - Streamlit chat app with quick-actions and End Chat / Restart Chat behavior
 
 import os
+import sys
+import threading
+import time
 import streamlit as st
-from datetime import datetime
-from agent_logic import SupportAgent
-from faq_kb import FAQ_DATABASE
-
-# ---------------------------
-# Helper: safe rerun across Streamlit versions
-# ---------------------------
-def safe_rerun():
-    """
-    Attempt to programmatically rerun the Streamlit script in a way that works across
-    different Streamlit versions.
-    """
-    try:
-        st.experimental_rerun()
-    except Exception:
-        try:
-            from streamlit.runtime.scriptrunner import RerunException
-            raise RerunException()
-        except Exception:
-            st.markdown("<script>window.location.reload()</script>", unsafe_allow_html=True)
-
+from agent_logic import AgentResponse, SupportAgent, build_faq_index, small_talk_reply
+from faq_kb import FAQ_CATEGORIES, FAQ_DATABASE, FAQ_QUESTIONS
 
 # ---------------------------
 # Page config & CSS
@@ -34,48 +18,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-st.markdown("""
-    <style>
-    .stChatMessage {
-        background-color: #f0f2f6;
-        border-radius: 8px;
-        padding: 12px;
-        margin: 8px 0;
-    }
-    .escalation-badge {
-        background-color: #ff6b6b;
-        color: white;
-        padding: 6px 12px;
-        border-radius: 20px;
-        font-size: 12px;
-        font-weight: bold;
-    }
-    .resolved-badge {
-        background-color: #51cf66;
-        color: white;
-        padding: 6px 12px;
-        border-radius: 20px;
-        font-size: 12px;
-        font-weight: bold;
-    }
-    .end-chat {
-        background-color: #6c757d;
-        color: white;
-        padding: 6px 12px;
-        border-radius: 8px;
-    }
-    </style>
-""", unsafe_allow_html=True)
+# Stylesheet lives in style.css; read from disk once per process
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "style.css")
+
+
+@st.cache_data
+def load_css():
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
+
+st.markdown(load_css(), unsafe_allow_html=True)
 
 
 # ---------------------------
 # Session state initialization
 # ---------------------------
+def _new_ticket():
+    # Unix seconds: unique enough per chat and cheaper than strftime
+    return f"TKT-{int(time.time())}"
+
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
 if "ticket_id" not in st.session_state:
-    st.session_state.ticket_id = f"TKT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    st.session_state.ticket_id = _new_ticket()
 
 if "escalated" not in st.session_state:
     st.session_state.escalated = False
@@ -87,20 +55,91 @@ if "chat_ended" not in st.session_state:
 if "quick_reply" not in st.session_state:
     st.session_state.quick_reply = None
 
-# Guarded agent initialization so we don't recreate on each rerun
-if "agent_initialized" not in st.session_state:
-    st.session_state.agent_initialized = False
+# Default response store for the app (RESPONSE_CACHE_DB overrides it)
+APP_RESPONSE_CACHE_DB = os.path.join(".cache", "responses.sqlite")
 
-if not st.session_state.agent_initialized:
-    try:
-        if not os.getenv("GEMINI_API_KEY"):
-            # show as a non-blocking warning; agent_logic may also validate on init
-            st.warning("GEMINI_API_KEY not found in environment. Set it if required by your agent.")
-        st.session_state.agent = SupportAgent(FAQ_DATABASE)
-        st.session_state.agent_initialized = True
-    except Exception as e:
-        st.error(f"Failed to initialize SupportAgent: {e}")
-        st.stop()
+
+# FAQ embeddings (SEMANTIC_FAQ) are computed once per server process
+@st.cache_resource
+def get_faq_index():
+    return build_faq_index(FAQ_DATABASE)
+
+
+# Most Gemini requests in flight at once across all sessions
+LLM_CONCURRENCY = 4
+
+
+@st.cache_resource
+def llm_slots():
+    return threading.Semaphore(LLM_CONCURRENCY)
+
+
+# One agent per server process, shared by every session (built on first use)
+@st.cache_resource
+def get_agent():
+    # no st.* calls in here: elements created in a cached function are replayed on every hit
+    # answers persist on disk so restarts and other workers reuse them
+    return SupportAgent(
+        FAQ_DATABASE,
+        cache_db=os.getenv("RESPONSE_CACHE_DB", APP_RESPONSE_CACHE_DB),
+        faq_index=get_faq_index(),
+        # only model calls take a slot; cache and FAQ hits answer immediately
+        model_gate=llm_slots(),
+    )
+
+
+# Warn once per session; without a key the agent falls back to FAQ answers
+if not os.getenv("GEMINI_API_KEY") and not st.session_state.get("api_key_warned"):
+    st.session_state.api_key_warned = True
+    st.warning("GEMINI_API_KEY not found in environment. Set it if required by your agent.")
+
+try:
+    get_agent()
+except Exception as e:
+    st.error(f"Failed to initialize SupportAgent: {e}")
+    st.stop()
+
+
+# FAQ_DATABASE is a module constant, so its sidebar summary only needs computing once
+@st.cache_data
+def faq_stats():
+    return len(FAQ_QUESTIONS), len(set(FAQ_CATEGORIES))
+
+
+@st.cache_data
+def faq_markdown():
+    return "\n\n".join(
+        f"**{i}. {question}**\n\n*Category: {category}*"
+        for i, (question, category) in enumerate(zip(FAQ_QUESTIONS, FAQ_CATEGORIES), 1)
+    )
+
+
+# ---------------------------
+# Chat controls (button callbacks run before the rerun they trigger)
+# ---------------------------
+def new_chat():
+    st.session_state.messages = []
+    st.session_state.ticket_id = _new_ticket()
+    st.session_state.escalated = False
+    st.session_state.chat_ended = False
+    st.session_state.quick_reply = None
+    st.session_state.pop("history_window", None)
+
+
+def clear_history():
+    st.session_state.messages = []
+    st.session_state.pop("history_window", None)
+
+
+def end_chat():
+    # Append a polite closing assistant message and mark chat ended
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": "Thank you for chatting with us! If you have more questions later, just start a new chat. Have a great day! 😊",
+        "escalation_reason": None,
+        "actions": None
+    })
+    st.session_state.chat_ended = True
 
 
 # ---------------------------
@@ -114,18 +153,10 @@ with st.sidebar:
 
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("New Chat", use_container_width=True):
-            st.session_state.messages = []
-            st.session_state.ticket_id = f"TKT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            st.session_state.escalated = False
-            st.session_state.chat_ended = False
-            st.session_state.quick_reply = None
-            safe_rerun()
+        st.button("New Chat", use_container_width=True, on_click=new_chat)
 
     with col2:
-        if st.button("Clear History", use_container_width=True):
-            st.session_state.messages = []
-            safe_rerun()
+        st.button("Clear History", use_container_width=True, on_click=clear_history)
 
     st.markdown("---")
     st.subheader("Status")
@@ -141,35 +172,19 @@ with st.sidebar:
 
     st.markdown("---")
     st.subheader("Knowledge Base")
-    st.write(f"📚 **Total FAQs:** {len(FAQ_DATABASE)}")
-    st.write(f"📖 **Categories:** {len(set(faq.get('category', 'General') for faq in FAQ_DATABASE))}")
+    total_faqs, total_categories = faq_stats()
+    st.write(f"📚 **Total FAQs:** {total_faqs}")
+    st.write(f"📖 **Categories:** {total_categories}")
 
     with st.expander("View All FAQs"):
-        for i, faq in enumerate(FAQ_DATABASE, 1):
-            st.write(f"**{i}. {faq['question']}**")
-            st.write(f"*Category: {faq.get('category', 'General')}*")
+        st.markdown(faq_markdown())
 
     st.markdown("---")
     # End Chat and Restart Chat controls
     if not st.session_state.chat_ended:
-        if st.button("End Chat", key="sidebar_end_chat", use_container_width=True):
-            # Append a polite closing assistant message and mark chat ended
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": "Thank you for chatting with us! If you have more questions later, just start a new chat. Have a great day! 😊",
-                "escalation_reason": None,
-                "actions": None
-            })
-            st.session_state.chat_ended = True
-            safe_rerun()
+        st.button("End Chat", key="sidebar_end_chat", use_container_width=True, on_click=end_chat)
     else:
-        if st.button("Restart Chat", key="sidebar_restart", use_container_width=True):
-            st.session_state.messages = []
-            st.session_state.ticket_id = f"TKT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            st.session_state.escalated = False
-            st.session_state.chat_ended = False
-            st.session_state.quick_reply = None
-            safe_rerun()
+        st.button("Restart Chat", key="sidebar_restart", use_container_width=True, on_click=new_chat)
 
 
 # ---------------------------
@@ -179,67 +194,87 @@ st.header("AI Support Assistant")
 st.write("Hello! I'm your AI support assistant. I can help you with common questions and issues. If I can't resolve your problem, I'll escalate it to a human agent.")
 
 # ---------------------------
-# Display chat history (render actions if present)
+# Answering a message
 # ---------------------------
-for idx, message in enumerate(st.session_state.messages):
-    role = message.get("role", "assistant")
-    content = message.get("content", "")
-    esc = message.get("escalation_reason")
-    actions = message.get("actions")
+# Ensure processing lock exists
+if "processing" not in st.session_state:
+    st.session_state.processing = False
 
-    try:
-        with st.chat_message(role):
-            st.markdown(content)
-            if esc:
-                st.info(f"📌 Escalation Reason: {esc}")
 
-            if role == "assistant" and actions:
-                st.write("")
-                # render horizontally if <=5 actions, else vertically
-                if len(actions) <= 5:
-                    cols = st.columns(len(actions))
-                    for i, action in enumerate(actions):
-                        btn_key = f"quick_action_{idx}_{i}_{st.session_state.ticket_id}"
-                        if cols[i].button(action, key=btn_key):
-                            st.session_state.quick_reply = action
-                            # do not append extra messages here; let main input loop handle it
-                            safe_rerun()
+def respond(user_input):
+    """
+    Draw the user's message and the agent's reply (streamed as Gemini generates it)
+    below the history, and append both to it. Returns the AgentResponse.
+    """
+    st.session_state.processing = True
+    try:
+        with st.chat_message("user"):
+            st.markdown(user_input)
+
+        with st.chat_message("assistant"):
+            canned = small_talk_reply(user_input)
+            if canned is not None:
+                # greetings / thanks / goodbyes: no agent call, no slot, no spinner
+                result = canned
+                st.markdown(result.reply)
+            else:
+                # the spinner covers the wait for a free model slot and the first chunk; the rest streams in
+                with st.spinner("AI agent is thinking..."):
+                    try:
+                        streaming = get_agent().process_query_stream(user_input)
+                    except Exception as e:
+                        # only agent failures become the fallback; Streamlit's rerun/stop
+                        # exceptions (also Exception subclasses) must propagate
+                        streaming = AgentResponse(
+                            "Sorry — I couldn't process your request due to a backend error.",
+                            True,
+                            f"Processing error: {e}",
+                            None,
+                        )
+                if isinstance(streaming.reply, str):
+                    st.markdown(streaming.reply)
+                    result = AgentResponse(*streaming)
                 else:
-                    for i, action in enumerate(actions):
-                        btn_key = f"quick_action_{idx}_{i}_{st.session_state.ticket_id}"
-                        if st.button(action, key=btn_key):
-                            st.session_state.quick_reply = action
-                            safe_rerun()
-    except Exception:
-        st.markdown(f"**{role.upper()}**: {content}")
-        if esc:
-            st.info(f"📌 Escalation Reason: {esc}")
+                    # errors inside the stream are handled by the agent (interrupted-answer notice)
+                    result = AgentResponse(st.write_stream(streaming.reply), *streaming[1:])
+
+        # both turns go into the history with a single session-state write
+        st.session_state.messages = st.session_state.messages + [
+            {
+                "role": "user",
+                "content": user_input
+            },
+            {
+                "role": "assistant",
+                "content": result.reply,
+                "escalation_reason": result.reason if result.escalate else None,
+                # immutable and shared: answers replayed from the disk cache come back as lists
+                "actions": tuple(sys.intern(a) for a in result.suggestions) if result.suggestions else None
+            },
+        ]
+
+        # Update escalation / flags
+        if result.escalate:
+            st.session_state.escalated = True
+    finally:
+        # release processing lock, also when a click interrupts the stream
+        st.session_state.processing = False
+    return result
 
 
 # ---------------------------
-# Inline End Chat button below messages (for convenience)
+# Display chat history (render actions if present)
 # ---------------------------
-if not st.session_state.chat_ended and not st.session_state.escalated:
-    inline_col1, inline_col2 = st.columns([1, 3])
-    with inline_col1:
-        if st.button("End Chat", key="inline_end"):
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": "Thank you for chatting with us! If you have more questions later, just start a new chat. Have a great day! 😊",
-                "escalation_reason": None,
-                "actions": None
-            })
-            st.session_state.chat_ended = True
-            safe_rerun()
-    with inline_col2:
-        # show a small hint / quick-action suggestion
-        st.write("Need help? Type your question or use the quick-action buttons above.")
+# Number of most recent messages drawn per run (and added by each "Load older" click)
+HISTORY_WINDOW = 30
 
 
-# ---------------------------
-# DISPLAY CHAT HISTORY (with action buttons)
-# ---------------------------
-for idx, message in enumerate(st.session_state.messages):
+def choose_quick_reply(action):
+    st.session_state.quick_reply = action
+
+
+def render_message(idx, message):
+    """Draw one history entry; idx (its position in the full history) keeps button keys stable."""
     role = message.get("role", "assistant")
     content = message.get("content", "")
     esc = message.get("escalation_reason")
@@ -251,103 +286,83 @@ for idx, message in enumerate(st.session_state.messages):
             if esc:
                 st.info(f"📌 Escalation Reason: {esc}")
 
-            # Render action buttons (if assistant provided any)
             if role == "assistant" and actions:
                 st.write("")
-                # horizontal if small number, else vertical
+                # render horizontally if <=5 actions, else vertically
+                # the click callback stores the action before the fragment reruns
                 if len(actions) <= 5:
                     cols = st.columns(len(actions))
                     for i, action in enumerate(actions):
-                        btn_key = f"quick_action_{idx}_{i}_{st.session_state.ticket_id}"
-                        if cols[i].button(action, key=btn_key):
-                            # set quick_reply and let the run finish — Streamlit auto-reruns
-                            st.session_state.quick_reply = action
+                        cols[i].button(action, key=f"qa_{idx}_{i}", on_click=choose_quick_reply, args=(action,))
                 else:
                     for i, action in enumerate(actions):
-                        btn_key = f"quick_action_{idx}_{i}_{st.session_state.ticket_id}"
-                        if st.button(action, key=btn_key):
-                            st.session_state.quick_reply = action
-
+                        st.button(action, key=f"qa_{idx}_{i}", on_click=choose_quick_reply, args=(action,))
     except Exception:
         st.markdown(f"**{role.upper()}**: {content}")
         if esc:
             st.info(f"📌 Escalation Reason: {esc}")
 
-# ---------------------------
-# CHAT INPUT HANDLING (replace your previous block with this)
-# ---------------------------
-# Ensure processing lock exists
-if "processing" not in st.session_state:
-    st.session_state.processing = False
 
-if not st.session_state.escalated and not st.session_state.chat_ended:
-    # 1) If a quick_reply exists (set by clicking a button in previous run or current run),
-    #    consume it immediately as the user_input for this run.
+# A fragment: quick-action clicks rerun only this block, not the sidebar and the rest of the page
+@st.fragment
+def render_history():
+    # Only the newest messages are drawn; older ones load a window at a time
+    messages = st.session_state.messages
+    window = st.session_state.get("history_window", HISTORY_WINDOW)
+    first = max(len(messages) - window, 0)
+    if first:
+        st.button(
+            f"Load older messages ({first} hidden)",
+            key="load_older",
+            on_click=lambda: st.session_state.update(history_window=window + HISTORY_WINDOW),
+        )
+
+    for idx, message in enumerate(messages[first:], start=first):
+        render_message(idx, message)
+
+    # A quick action clicked just now is answered below the history
     if st.session_state.get("quick_reply"):
-        user_input = st.session_state.quick_reply
-        # show to user so they see what was selected
-        st.info(f"Quick action selected: **{user_input}**")
-        # clear quick_reply so we don't reuse it in subsequent reruns
+        action = st.session_state.quick_reply
         st.session_state.quick_reply = None
-    else:
-        # 2) Otherwise, show normal chat input
-        user_input = st.chat_input("Type your question or issue here...")
+        if not st.session_state.escalated and not st.session_state.chat_ended:
+            result = respond(action)
+            if result.escalate:
+                # sidebar status and chat input live outside the fragment
+                st.rerun()
+            elif result.suggestions:
+                st.rerun(scope="fragment")
 
-    # 3) Process the input synchronously in this run (no safe_rerun after appending assistant response)
-    if user_input and not st.session_state.processing:
-        st.session_state.processing = True
 
-        # Append user message right away (so it shows)
-        st.session_state.messages.append({
-            "role": "user",
-            "content": user_input
-        })
+render_history()
 
-        # Determine whether to skip spinner for greetings
-        is_greeting = isinstance(user_input, str) and user_input.strip().lower() in ["hi", "hello", "hey", "hii"]
 
-        # Call agent synchronously and capture result (handle 3- or 4-tuple)
-        try:
-            if is_greeting:
-                result = st.session_state.agent.process_query(user_input)
-            else:
-                with st.spinner("AI agent is thinking..."):
-                    result = st.session_state.agent.process_query(user_input)
-        except Exception as e:
-            # On any exception, return a friendly fallback and escalate
-            result = ("Sorry — I couldn't process your request due to a backend error.", True, f"Processing error: {e}", None)
-
-        # Normalize result
-        if isinstance(result, tuple) and len(result) == 4:
-            response_text, is_escalated, escalation_reason, actions = result
-        elif isinstance(result, tuple) and len(result) == 3:
-            response_text, is_escalated, escalation_reason = result
-            actions = None
-        else:
-            response_text = str(result)
-            is_escalated = False
-            escalation_reason = None
-            actions = None
-
-        # Append assistant response in the same run (important!)
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": response_text,
-            "escalation_reason": escalation_reason if is_escalated else None,
-            "actions": actions
-        })
+# ---------------------------
+# CHAT INPUT HANDLING
+# ---------------------------
+if not st.session_state.escalated and not st.session_state.chat_ended:
+    user_input = st.chat_input("Type your question or issue here...")
+    if user_input and not st.session_state.processing:
+        respond(user_input)
+        # Redraw from the history: the live copy drawn above sits outside the history
+        # fragment and would linger next to it on the next fragment-only rerun; the
+        # rerun also shows escalation status and quick-action buttons
+        st.rerun()
 
-        # Update escalation / flags
-        if is_escalated:
-            st.session_state.escalated = True
 
-        # release processing lock
-        st.session_state.processing = False
+# ---------------------------
+# Inline End Chat button below messages (for convenience)
+# ---------------------------
+if not st.session_state.chat_ended and not st.session_state.escalated:
+    inline_col1, inline_col2 = st.columns([1, 3])
+    with inline_col1:
+        st.button("End Chat", key="inline_end", on_click=end_chat)
+    with inline_col2:
+        # show a small hint / quick-action suggestion
+        st.write("Need help? Type your question or use the quick-action buttons above.")
 
-        # DO NOT call safe_rerun() or st.rerun() here — let the current run render everything.
-else:
-    # if escalated or chat ended, show appropriate messages (input disabled)
-    if st.session_state.escalated:
-        st.info("This conversation has been escalated to a human support agent. Thank you for your patience!")
-    elif st.session_state.chat_ended:
-        st.info("Chat ended. Use 'Restart Chat' in the sidebar to start a new conversation.")
+
+# if escalated or chat ended, show appropriate messages (input disabled)
+if st.session_state.escalated:
+    st.info("This conversation has been escalated to a human support agent. Thank you for your patience!")
+elif st.session_state.chat_ended:
+    st.info("Chat ended. Use 'Restart Chat' in the sidebar to start a new conversation.")
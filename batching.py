@@ -0,0 +1,79 @@
+# batching.py
+"""
+Micro-batching for concurrent model calls.
+
+BatchScheduler collects prompts that arrive within a short window, issues one
+upstream call per distinct prompt (identical prompts share a single call) and
+fans each result back out to every waiting caller.
+
+Gemini's generate_content treats a list input as the parts of ONE conversation,
+not as independent requests, so a window's prompts are dispatched concurrently
+rather than concatenated into a single request.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# How long the scheduler waits for more prompts after the first one arrives (seconds)
+BATCH_WINDOW = 0.02
+
+# Max prompts collected into one batch
+BATCH_MAX_SIZE = 16
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        call: Callable[[str], Awaitable[str]],
+        window: float = BATCH_WINDOW,
+        max_batch: int = BATCH_MAX_SIZE,
+    ):
+        self._call = call
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: "asyncio.Queue[Tuple[str, asyncio.Future]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    async def submit(self, prompt: str) -> str:
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._collect())
+        future = loop.create_future()
+        await self._queue.put((prompt, future))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # dispatch in the background so the next window starts collecting immediately
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        waiters: Dict[str, List[asyncio.Future]] = {}
+        for prompt, future in batch:
+            waiters.setdefault(prompt, []).append(future)
+
+        prompts = list(waiters)
+        results = await asyncio.gather(*(self._call(p) for p in prompts), return_exceptions=True)
+
+        for prompt, result in zip(prompts, results):
+            for future in waiters[prompt]:
+                if future.done():  # caller went away
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
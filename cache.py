@@ -0,0 +1,192 @@
+# cache.py
+"""
+Response caches used by SupportAgent.
+
+- KVCache is a small SQLite-backed key/value store with per-entry expiry. It keeps
+  exact-match answers across restarts and lets several workers share them.
+  Expired rows are deleted as they are met and, with the oldest rows beyond
+  `max_entries`, in a sweep every KV_CACHE_PRUNE_EVERY writes.
+- SemanticCache reuses a previous model answer when a new query is a close
+  paraphrase of one already answered (sentence-transformers embeddings searched
+  with a FAISS inner-product index). Both libraries are optional and imported
+  only when the cache is constructed. Given a SQLite path, cached answers and
+  their embeddings are stored there and the index is rebuilt on startup.
+  Entries expire after `ttl` seconds and only the newest `max_entries` are kept.
+"""
+
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional
+
+# Small multilingual encoder (384-dim) used for query embeddings
+SEMANTIC_CACHE_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+
+# Cosine similarity at or above which a cached answer is reused
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+# Seconds a persisted exact-match answer stays valid
+KV_CACHE_TTL = 24 * 3600
+
+# Most exact-match answers kept on disk; the table is swept every this many writes
+KV_CACHE_MAX_ENTRIES = 10_000
+KV_CACHE_PRUNE_EVERY = 100
+
+# Most paraphrase entries kept in the semantic index (and its SQLite table)
+SEMANTIC_CACHE_MAX_ENTRIES = 10_000
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class KVCache:
+    def __init__(self, path: str, ttl: int = KV_CACHE_TTL, max_entries: int = KV_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at INTEGER NOT NULL)"
+            )
+            self._prune()
+
+    def _prune(self) -> None:
+        """Delete expired rows and all but the newest max_entries (caller holds lock + transaction)."""
+        self._conn.execute("DELETE FROM kv WHERE expires_at < ?", (int(time.time()),))
+        # every row gets the same ttl, so the latest expiry (then rowid: REPLACE re-inserts) is the latest write
+        self._conn.execute(
+            "DELETE FROM kv WHERE key NOT IN (SELECT key FROM kv ORDER BY expires_at DESC, rowid DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] < time.time():
+                with self._conn:
+                    self._conn.execute("DELETE FROM kv WHERE key = ? AND expires_at = ?", (key, row[1]))
+                return None
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), int(time.time()) + self.ttl),
+            )
+            self._writes += 1
+            if self._writes % KV_CACHE_PRUNE_EVERY == 0:
+                self._prune()
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        model_name: str = SEMANTIC_CACHE_MODEL,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        path: Optional[str] = None,
+        ttl: int = KV_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        # heavy imports are deferred so the agent still loads without them
+        import faiss  # type: ignore
+        import numpy as np
+        from sentence_transformers import SentenceTransformer  # type: ignore
+
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._encoder = SentenceTransformer(model_name)
+        self._dim = self._encoder.get_sentence_embedding_dimension()
+        self._index = faiss.IndexFlatIP(self._dim)
+        self._responses: List[str] = []
+        # insertion times, parallel to _responses and ascending, so expired entries are a prefix
+        self._created: List[int] = []
+        self._lock = threading.Lock()
+
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = _connect(path)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS semantic ("
+                    "row_id INTEGER PRIMARY KEY, query TEXT, response TEXT NOT NULL, "
+                    "embedding BLOB NOT NULL, created_at INTEGER NOT NULL)"
+                )
+                self._prune_db()
+            rows = self._conn.execute(
+                "SELECT response, embedding, created_at FROM semantic ORDER BY row_id"
+            ).fetchall()
+            # rows written by a different encoder can't be searched with this one
+            rows = [row for row in rows if len(row[1]) == self._dim * 4]
+            if rows:
+                self._index.add(np.vstack([np.frombuffer(emb, dtype="float32") for _, emb, _ in rows]))
+                self._responses = [response for response, _, _ in rows]
+                self._created = [created_at for _, _, created_at in rows]
+
+    def _prune_db(self) -> None:
+        """Delete expired rows and all but the newest max_entries (caller holds a transaction)."""
+        self._conn.execute("DELETE FROM semantic WHERE created_at < ?", (int(time.time()) - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM semantic WHERE row_id NOT IN "
+            "(SELECT row_id FROM semantic ORDER BY row_id DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def _evict(self, now: int) -> None:
+        """
+        Once the index outgrows max_entries, drop expired entries and the oldest ones
+        down to 90% of the cap, so the (linear) compaction runs only every so often.
+        Lookups already skip expired entries in between. Caller holds the lock.
+        """
+        import faiss  # type: ignore
+
+        if len(self._responses) <= self.max_entries:
+            return
+        n = max(bisect.bisect_left(self._created, now - self.ttl), len(self._responses) - self.max_entries * 9 // 10)
+        # IndexFlat compacts on removal, so the remaining ids stay aligned with the lists
+        self._index.remove_ids(faiss.IDSelectorRange(0, n))
+        del self._responses[:n]
+        del self._created[:n]
+        if self._conn is not None:
+            with self._conn:
+                self._prune_db()
+
+    def embed(self, text: str):
+        """Return a (1, dim) float32 L2-normalized embedding, so inner product == cosine."""
+        return self._encoder.encode([text], normalize_embeddings=True, convert_to_numpy=True).astype("float32")
+
+    def lookup(self, vec) -> Optional[str]:
+        with self._lock:
+            if self._index.ntotal == 0:
+                return None
+            scores, ids = self._index.search(vec, 1)
+            i = int(ids[0, 0])
+            if scores[0, 0] >= self.threshold and self._created[i] >= time.time() - self.ttl:
+                return self._responses[i]
+        return None
+
+    def add(self, vec, response: str, query: Optional[str] = None) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._index.add(vec)
+            self._responses.append(response)
+            self._created.append(now)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO semantic (query, response, embedding, created_at) VALUES (?, ?, ?, ?)",
+                        (query, response, vec.tobytes(), now),
+                    )
+            self._evict(now)
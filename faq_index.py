@@ -0,0 +1,62 @@
+# faq_index.py
+"""
+Semantic FAQ retrieval.
+
+FaqIndex embeds every FAQ question once with a sentence-transformer and answers
+queries with a FAISS inner-product search over the L2-normalized vectors, so the
+score is the cosine similarity. Paraphrases that share few words with the stored
+question ("get my money back" vs "What is your refund policy?") still match.
+Large knowledge bases are stored as 8-bit quantized vectors (and, larger still,
+searched through an IVF index). sentence-transformers and faiss are optional and
+imported only when an index is built.
+"""
+
+import math
+from typing import List, Optional, Tuple
+
+# Compact English encoder (384-dim) used for FAQ questions
+FAQ_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Above this many FAQs an IVF index (nlist = 4*sqrt(N)) replaces the exact flat scan
+IVF_MIN_SIZE = 25000
+
+# From this many FAQs on, vectors are stored as 8-bit scalar-quantized codes
+# (1 byte per dimension instead of 4); cosine scores become approximate
+SQ8_MIN_SIZE = 1000
+
+
+class FaqIndex:
+    def __init__(self, questions: List[str], model_name: str = FAQ_EMBEDDING_MODEL):
+        import faiss  # type: ignore
+        from sentence_transformers import SentenceTransformer  # type: ignore
+
+        self._encoder = SentenceTransformer(model_name)
+        embeddings = self._embed(list(questions))
+        dim = embeddings.shape[1]
+
+        sq8 = faiss.ScalarQuantizer.QT_8bit
+        if len(questions) >= IVF_MIN_SIZE:
+            nlist = int(4 * math.sqrt(len(questions)))
+            self._index = faiss.IndexIVFScalarQuantizer(
+                faiss.IndexFlatIP(dim), dim, nlist, sq8, faiss.METRIC_INNER_PRODUCT
+            )
+            self._index.nprobe = 8
+        elif len(questions) >= SQ8_MIN_SIZE:
+            self._index = faiss.IndexScalarQuantizer(dim, sq8, faiss.METRIC_INNER_PRODUCT)
+        else:
+            self._index = faiss.IndexFlatIP(dim)
+        if not self._index.is_trained:
+            self._index.train(embeddings)
+        self._index.add(embeddings)
+
+    def _embed(self, texts: List[str]):
+        return self._encoder.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype("float32")
+
+    def search(self, query: str) -> Optional[Tuple[int, float]]:
+        """(FAQ index, cosine similarity) of the closest question, or None if the index is empty."""
+        if self._index.ntotal == 0:
+            return None
+        scores, ids = self._index.search(self._embed([query]), 1)
+        if ids[0, 0] < 0:
+            return None
+        return int(ids[0, 0]), float(scores[0, 0])
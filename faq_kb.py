@@ -51,3 +51,8 @@ FAQ_DATABASE = [
         "category": "Security"
     }
 ]
+
+# Column views of FAQ_DATABASE (parallel, same order) for bulk scans and stats
+FAQ_QUESTIONS = tuple(faq["question"] for faq in FAQ_DATABASE)
+FAQ_ANSWERS = tuple(faq["answer"] for faq in FAQ_DATABASE)
+FAQ_CATEGORIES = tuple(faq.get("category", "General") for faq in FAQ_DATABASE)
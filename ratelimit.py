@@ -0,0 +1,66 @@
+# ratelimit.py
+"""
+Client-side rate limiting for model calls.
+
+TokenBucket keeps requests-per-minute and tokens-per-minute budgets that refill
+continuously. A caller reserves one request plus its estimated tokens and then
+sleeps just long enough for the budget to cover it, so bursts are smoothed out
+locally instead of coming back from the API as HTTP 429. After a 429 anyway,
+penalize() holds every caller back for a jittered cool-off.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+# Base cool-off (seconds) after the API answers 429; up to the same again is added as jitter
+RATE_LIMIT_BACKOFF = 2.0
+
+
+class TokenBucket:
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """Take one request + `tokens` from the budget; return how long to wait before using them."""
+        tokens = min(max(tokens, 0), self.tpm)
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+            # the balance may go negative: later callers queue up behind this reservation
+            self._requests -= 1
+            self._tokens -= tokens
+            return max(
+                -self._requests * 60.0 / self.rpm,
+                -self._tokens * 60.0 / self.tpm,
+                self._blocked_until - now,
+                0.0,
+            )
+
+    def acquire(self, tokens: int = 0) -> None:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, backoff: float = RATE_LIMIT_BACKOFF) -> None:
+        """Hold all callers back after a 429 and drain the request budget."""
+        with self._lock:
+            until = time.monotonic() + backoff + random.uniform(0, backoff)
+            self._blocked_until = max(self._blocked_until, until)
+            self._requests = min(self._requests, 0.0)